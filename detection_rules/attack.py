@@ -11,10 +11,9 @@ from typing import Optional
 
 import json
 import requests
-from collections import OrderedDict
 
 from semver import Version
-from .utils import cached, clear_caches, get_etc_path, get_etc_glob_path, read_gzip, gzip_compress
+from .utils import cached, clear_caches, get_etc_path, get_etc_glob_path, gzip_compress, load_gzip_json
 
 PLATFORMS = ['Windows', 'macOS', 'Linux']
 CROSSWALK_FILE = Path(get_etc_path('attack-crosswalk.json'))
@@ -45,7 +44,7 @@ CURRENT_ATTACK_VERSION = _attack_path_base[:-_ext_length]
 
 def load_attack_gz() -> dict:
 
-    return json.loads(read_gzip(get_attack_file_path()))
+    return load_gzip_json(get_attack_file_path())
 
 
 attack = load_attack_gz()
@@ -90,7 +89,7 @@ for tactic in matrix:
     matrix[tactic].sort(key=lambda tid: technique_lookup[tid]['name'].lower())
 
 
-technique_lookup = OrderedDict(sorted(technique_lookup.items()))
+technique_lookup = dict(sorted(technique_lookup.items()))
 techniques = sorted({v['name'] for k, v in technique_lookup.items()})
 technique_id_list = [t for t in technique_lookup if '.' not in t]
 sub_technique_id_list = [t for t in technique_lookup if '.' in t]
@@ -16,26 +16,23 @@ import yaml
 
 import kql
 
-from .utils import (DateTimeEncoder, cached, get_etc_path, gzip_compress,
-                    read_gzip, unzip)
+from .utils import (DateTimeEncoder, cached, download_zip, get_etc_path, gzip_compress,
+                    load_gzip_json)
 
 
 def _decompress_and_save_schema(url, release_name):
     print(f"Downloading beats {release_name}")
-    response = requests.get(url)
-
-    print(f"Downloaded {len(response.content) / 1024.0 / 1024.0:.2f} MB release.")
 
     fs = {}
     parsed = {}
 
-    with unzip(response.content) as archive:
-        base_directory = archive.namelist()[0]
+    with download_zip(url, verbose=True) as archive:
+        members = archive.infolist()
+        base_directory = members[0].filename
 
-        for name in archive.namelist():
+        for member in members:
+            name = member.filename
             if os.path.basename(name) in ("fields.yml", "fields.common.yml", "config.yml"):
-                contents = archive.read(name)
-
                 # chop off the base directory name
                 key = name[len(base_directory):]
 
@@ -43,7 +40,9 @@ def _decompress_and_save_schema(url, release_name):
                     key = key[len("x-pack") + 1:]
 
                 try:
-                    decoded = yaml.safe_load(contents)
+                    # stream the member straight into the yaml parser
+                    with archive.open(member) as f:
+                        decoded = yaml.safe_load(f)
                 except yaml.YAMLError:
                     print(f"Error loading {name}")
 
@@ -213,7 +212,7 @@ def get_max_version() -> str:
 @cached
 def read_beats_schema(version: str = None):
     if version and version.lower() == 'main':
-        return json.loads(read_gzip(get_etc_path('beats_schemas', 'main.json.gz')))
+        return load_gzip_json(get_etc_path('beats_schemas', 'main.json.gz'))
 
     version = Version.parse(version) if version else None
     beats_schemas = get_versions()
@@ -223,7 +222,7 @@ def read_beats_schema(version: str = None):
 
     version = version or get_max_version()
 
-    return json.loads(read_gzip(get_etc_path('beats_schemas', f'v{version}.json.gz')))
+    return load_gzip_json(get_etc_path('beats_schemas', f'v{version}.json.gz'))
 
 
 def get_schema_from_datasets(beats, modules, datasets, version=None):
@@ -47,7 +47,7 @@ from .rule import (AnyRuleData, BaseRuleData, DeprecatedRule, QueryRuleData,
                    ThreatMapping, TOMLRule)
 from .rule_loader import RuleCollection, production_filter
 from .schemas import definitions, get_stack_versions
-from .utils import (dict_hash, get_etc_path, get_path, load_dump,
+from .utils import (dict_hash, get_etc_path, get_path, iter_json_lines, load_dump,
                     load_etc_dump, save_etc_dump)
 from .version_lock import VersionLockFile, default_version_lock
 
@@ -1031,8 +1031,9 @@ def test_group():
 @click.option('--max-results', '-m', type=click.IntRange(1, 1000), default=100,
               help='Max results to return (capped at 1000)')
 @click.option('--verbose', '-v', is_flag=True, default=True)
+@click.option('--pretty', is_flag=True, help='Indent results')
 @add_client('elasticsearch')
-def event_search(query, index, language, date_range, count, max_results, verbose=True,
+def event_search(query, index, language, date_range, count, max_results, verbose=True, pretty=False,
                  elasticsearch_client: Elasticsearch = None):
     """Search using a query against an Elasticsearch instance."""
     start_time, end_time = date_range
@@ -1050,7 +1051,7 @@ def event_search(query, index, language, date_range, count, max_results, verbose
     else:
         results = collector.search(query, language_used, index, start_time, end_time, max_results)
         click.echo(f'total results: {len(results)} (capped at {max_results})')
-        click.echo_via_pager(json.dumps(results, indent=2, sort_keys=True))
+        click.echo_via_pager(iter_json_lines(results, pretty=pretty))
 
     return results
 
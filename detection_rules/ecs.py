@@ -9,6 +9,7 @@ import glob
 import json
 import os
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import eql
@@ -17,8 +18,8 @@ import requests
 from semver import Version
 import yaml
 
-from .utils import (DateTimeEncoder, cached, get_etc_path, gzip_compress,
-                    load_etc_dump, read_gzip, unzip)
+from .utils import (DateTimeEncoder, cached, download_zip, get_etc_path, gzip_compress,
+                    load_etc_dump, load_gzip_json)
 
 ETC_NAME = "ecs_schemas"
 ECS_SCHEMAS_DIR = get_etc_path(ETC_NAME)
@@ -73,10 +74,14 @@ def get_schema_map():
 def get_schemas():
     """Get local schemas."""
     schema_map = get_schema_map()
+    schema_files = [(version, name, file_name) for version, values in schema_map.items()
+                    for name, file_name in values.items()]
 
-    for version, values in schema_map.items():
-        for name, file_name in values.items():
-            schema_map[version][name] = json.loads(read_gzip(file_name))
+    # decompression releases the GIL, so load the schema files concurrently
+    with ThreadPoolExecutor() as executor:
+        schemas = executor.map(load_gzip_json, [file_name for _, _, file_name in schema_files])
+        for (version, name, _), schema in zip(schema_files, schemas):
+            schema_map[version][name] = schema
 
     return schema_map
 
@@ -219,7 +224,7 @@ def download_schemas(refresh_master=True, refresh_all=False, verbose=True):
 
         schema_dir = os.path.join(ECS_SCHEMAS_DIR, str(version))
 
-        with unzip(requests.get(release['zipball_url']).content) as archive:
+        with download_zip(release['zipball_url']) as archive:
             name_list = archive.namelist()
             base = name_list[0]
 
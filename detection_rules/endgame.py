@@ -11,7 +11,7 @@ from pathlib import Path
 
 import eql
 
-from .utils import ETC_DIR, DateTimeEncoder, cached, gzip_compress, read_gzip
+from .utils import ETC_DIR, DateTimeEncoder, cached, gzip_compress, load_gzip_json
 
 ENDGAME_SCHEMA_DIR = Path(ETC_DIR) / "endgame_schemas"
 
@@ -97,6 +97,6 @@ def read_endgame_schema(endgame_version: str, warn=False) -> dict:
         else:
             raise FileNotFoundError(str(endgame_schema_path))
 
-    schema = json.loads(read_gzip(endgame_schema_path))
+    schema = load_gzip_json(endgame_schema_path)
 
     return schema
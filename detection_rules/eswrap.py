@@ -9,7 +9,7 @@ import os
 import sys
 import time
 from collections import defaultdict
-from typing import List, Union
+from typing import List, Optional, Union
 
 import click
 import elasticsearch
@@ -20,8 +20,9 @@ import kql
 from .main import root
 from .misc import add_params, client_error, elasticsearch_options, get_elasticsearch_client, nested_get
 from .rule import TOMLRule
-from .rule_loader import rta_mappings, RuleCollection
-from .utils import format_command_options, normalize_timing_and_sort, unix_time_to_formatted, get_path
+from .rule_loader import DEFAULT_RULES_DIR, dict_filter, rta_mappings, RuleCollection
+from .utils import (cached, dump_json_line, dumps_sorted, evaluate, format_command_options, iter_json_lines,
+                    loads_json, normalize_timing_and_sort, unix_time_to_formatted, get_path)
 
 
 COLLECTION_DIR = get_path('collections')
@@ -34,6 +35,15 @@ def add_range_to_dsl(dsl_filter, start_time, end_time='now'):
     )
 
 
+@cached
+def get_rule_by_id(rule_id: str) -> Optional[TOMLRule]:
+    """Load a single rule from the default rules directory by ID."""
+    # only the matching rule is validated, rather than loading the entire default collection
+    rules = RuleCollection()
+    rules.load_directory(DEFAULT_RULES_DIR, toml_filter=dict_filter(rule__rule_id=rule_id))
+    return rules.id_map.get(rule_id)
+
+
 def parse_unique_field_results(rule_type: str, unique_fields: List[str], search_results: dict):
     parsed_results = defaultdict(lambda: defaultdict(int))
     hits = search_results['hits']
@@ -87,27 +97,33 @@ class RtaEvents:
 
     def evaluate_against_rule_and_update_mapping(self, rule_id, rta_name, verbose=True):
         """Evaluate a rule against collected events and update mapping."""
-        from .utils import combine_sources, evaluate
-
-        rule = RuleCollection.default().id_map.get(rule_id)
+        rule = get_rule_by_id(rule_id)
         assert rule is not None, f"Unable to find rule with ID {rule_id}"
-        merged_events = combine_sources(*self.events.values())
-        filtered = evaluate(rule, merged_events)
 
-        if filtered:
-            sources = [e['agent']['type'] for e in filtered]
-            mapping_update = rta_mappings.add_rule_to_mapping_file(rule, len(filtered), rta_name, *sources)
+        # events are already grouped by agent.type, so evaluate per group rather than merging and re-sorting
+        match_counts = {source: len(evaluate(rule, events)) for source, events in self.events.items()}
+        sources = [source for source, count in match_counts.items() if count]
+
+        if sources:
+            count = sum(match_counts.values())
+            mapping_update = rta_mappings.add_rule_to_mapping_file(rule, rta_name, count, *sources)
 
             if verbose:
-                click.echo('Updated rule-mapping file with: \n{}'.format(json.dumps(mapping_update, indent=2)))
+                click.echo('Updated rule-mapping file with: \n{}'.format(dumps_sorted(mapping_update)))
         else:
             if verbose:
                 click.echo('No updates to rule-mapping file; No matching results')
 
-    def echo_events(self, pager=False, pretty=True):
+    def echo_events(self, pager=False, pretty=False):
         """Print events to stdout."""
-        echo_fn = click.echo_via_pager if pager else click.echo
-        echo_fn(json.dumps(self.events, indent=2 if pretty else None, sort_keys=True))
+        events = (event for source in sorted(self.events) for event in self.events[source])
+        lines = iter_json_lines(events, pretty=pretty)
+
+        if pager:
+            click.echo_via_pager(lines)
+        else:
+            for line in lines:
+                click.echo(line, nl=False)
 
     def save(self, rta_name=None, dump_dir=None, host_id=None):
         """Save collected events."""
@@ -117,8 +133,8 @@ class RtaEvents:
 
         for source, events in self.events.items():
             path = os.path.join(dump_dir, source + '.jsonl')
-            with open(path, 'w') as f:
-                f.writelines([json.dumps(e, sort_keys=True) + '\n' for e in events])
+            with open(path, 'wb') as f:
+                f.writelines(dump_json_line(e) for e in events)
                 click.echo('{} events saved to: {}'.format(len(events), path))
 
 
@@ -128,16 +144,24 @@ class CollectEvents(object):
     def __init__(self, client, max_events=3000):
         self.client: Elasticsearch = client
         self.max_events = max_events
+        self._timestamp_maps = {}
 
     def _build_timestamp_map(self, index_str):
         """Build a mapping of indexes to timestamp data formats."""
-        mappings = self.client.indices.get_mapping(index=index_str)
-        timestamp_map = {n: m['mappings'].get('properties', {}).get('@timestamp', {}) for n, m in mappings.items()}
-        return timestamp_map
+        if index_str not in self._timestamp_maps:
+            # only the @timestamp mapping is needed, so trim the rest of the response server side
+            mappings = self.client.indices.get_mapping(index=index_str,
+                                                       filter_path='*.mappings.properties.@timestamp')
+            self._timestamp_maps[index_str] = {n: m['mappings']['properties']['@timestamp']
+                                               for n, m in mappings.items()}
+
+        return self._timestamp_maps[index_str]
 
     def _get_last_event_time(self, index_str, dsl=None):
         """Get timestamp of most recent event."""
-        last_event = self.client.search(query=dsl, index=index_str, size=1, sort='@timestamp:desc')['hits']['hits']
+        last_event = self.client.search(query=dsl, index=index_str, size=1, sort='@timestamp:desc',
+                                        filter_path=['hits.hits._index', 'hits.hits._source.@timestamp'])
+        last_event = last_event.get('hits', {}).get('hits')
         if not last_event:
             return
 
@@ -146,7 +170,7 @@ class CollectEvents(object):
         timestamp = last_event['_source']['@timestamp']
 
         timestamp_map = self._build_timestamp_map(index_str)
-        event_date_format = timestamp_map[index].get('format', '').split('||')
+        event_date_format = timestamp_map.get(index, {}).get('format', '').split('||')
 
         # there are many native supported date formats and even custom data formats, but most, including beats use the
         # default `strict_date_optional_time`. It would be difficult to try to account for all possible formats, so this
@@ -188,15 +212,58 @@ class CollectEvents(object):
                                                                   start_time=start_time, end_time=end_time)
         formatted_dsl.update(size=size or self.max_events)
 
+        # only the hits are used, so drop the rest of the response envelope server side
         if language == 'eql':
-            results = self.client.eql.search(body=formatted_dsl, index=index_str, **kwargs)['hits']
+            kwargs.setdefault('filter_path', ['hits.events', 'hits.sequences'])
+            results = self.client.eql.search(body=formatted_dsl, index=index_str, **kwargs).get('hits', {})
             results = results.get('events') or results.get('sequences', [])
         else:
+            kwargs.setdefault('filter_path', 'hits.hits')
             results = self.client.search(body=formatted_dsl, q=lucene_query, index=index_str,
-                                         allow_no_indices=True, ignore_unavailable=True, **kwargs)['hits']['hits']
+                                         allow_no_indices=True, ignore_unavailable=True, **kwargs)
+            results = results.get('hits', {}).get('hits', [])
 
         return results
 
+    @staticmethod
+    def _build_paginated_body(formatted_dsl, pit_id, keep_alive, page_size):
+        """Build a search body for paginating with search_after and a point in time."""
+        return {
+            'query': formatted_dsl['query'],
+            'size': page_size,
+            'pit': {'id': pit_id, 'keep_alive': keep_alive},
+            'sort': [{'@timestamp': 'asc'}, {'_shard_doc': 'asc'}]
+        }
+
+    def iter_search(self, query, language, index: Union[str, list] = '*', start_time=None, end_time=None,
+                    page_size=1000, keep_alive='1m'):
+        """Paginate through all hits of a search using search_after with a point in time."""
+        if language == 'eql':
+            raise ValueError('Paginated search is not supported for eql queries')
+
+        index_str, formatted_dsl, lucene_query = self._prep_query(query=query, language=language, index=index,
+                                                                  start_time=start_time, end_time=end_time)
+        pit_id = self.client.open_point_in_time(index=index_str, keep_alive=keep_alive, ignore_unavailable=True)['id']
+
+        # the body is built once and only the pit id and search_after cursor are updated per page
+        body = self._build_paginated_body(formatted_dsl, pit_id, keep_alive, page_size)
+
+        try:
+            while True:
+                page = self.client.search(body=body, q=lucene_query,
+                                          filter_path=['pit_id', 'hits.hits._source', 'hits.hits.sort'])
+                hits = page.get('hits', {}).get('hits')
+                if not hits:
+                    break
+
+                yield from hits
+
+                # the pit id may change between requests, so always use the latest
+                body['pit']['id'] = page.get('pit_id', body['pit']['id'])
+                body['search_after'] = hits[-1]['sort']
+        finally:
+            self.client.close_point_in_time(id=body['pit']['id'])
+
     def search_from_rule(self, rules: RuleCollection, start_time=None, end_time='now', size=None):
         """Search an elasticsearch instance using a rule."""
         async_client = AsyncSearchClient(self.client)
@@ -274,17 +341,16 @@ class CollectEvents(object):
 
     def count(self, query, language, index: Union[str, list], start_time=None, end_time='now'):
         """Get a count of documents from elasticsearch."""
-        index_str, formatted_dsl, lucene_query = self._prep_query(query=query, language=language, index=index,
-                                                                  start_time=start_time, end_time=end_time)
-
         # EQL API has no count endpoint
         if language == 'eql':
             results = self.search(query=query, language=language, index=index, start_time=start_time, end_time=end_time,
                                   size=1000)
             return len(results)
-        else:
-            return self.client.count(body=formatted_dsl, index=index_str, q=lucene_query, allow_no_indices=True,
-                                     ignore_unavailable=True)['count']
+
+        index_str, formatted_dsl, lucene_query = self._prep_query(query=query, language=language, index=index,
+                                                                  start_time=start_time, end_time=end_time)
+        return self.client.count(body=formatted_dsl, index=index_str, q=lucene_query, allow_no_indices=True,
+                                 ignore_unavailable=True, filter_path='count')['count']
 
     def count_from_rule(self, rules: RuleCollection, start_time=None, end_time='now'):
         """Get a count of documents from elasticsearch using a rule."""
@@ -316,17 +382,17 @@ class CollectRtaEvents(CollectEvents):
     @staticmethod
     def _group_events_by_type(events):
         """Group events by agent.type."""
-        event_by_type = {}
+        event_by_type = defaultdict(list)
 
         for event in events:
-            event_by_type.setdefault(event['_source']['agent']['type'], []).append(event['_source'])
+            source = event['_source']
+            event_by_type[source['agent']['type']].append(source)
 
-        return event_by_type
+        return dict(event_by_type)
 
     def run(self, dsl, indexes, start_time):
         """Collect the events."""
-        results = self.search(dsl, language='dsl', index=indexes, start_time=start_time, end_time='now', size=5000,
-                              sort='@timestamp:asc')
+        results = self.iter_search(dsl, language='dsl', index=indexes, start_time=start_time, end_time='now')
         events = self._group_events_by_type(results)
         return RtaEvents(events)
 
@@ -336,7 +402,7 @@ class CollectRtaEvents(CollectEvents):
 def normalize_data(events_file):
     """Normalize Elasticsearch data timestamps and sort."""
     file_name = os.path.splitext(os.path.basename(events_file.name))[0]
-    events = RtaEvents({file_name: [json.loads(e) for e in events_file.readlines()]})
+    events = RtaEvents({file_name: [loads_json(e) for e in events_file]})
     events.save(dump_dir=os.path.dirname(events_file.name))
 
 
@@ -363,8 +429,9 @@ def es_group(ctx: click.Context, **kwargs):
 @click.option('--rta-name', '-r', help='Name of RTA in order to save events directly to unit tests data directory')
 @click.option('--rule-id', help='Updates rule mapping in rule-mapping.yml file (requires --rta-name)')
 @click.option('--view-events', is_flag=True, help='Print events after saving')
+@click.option('--pretty', is_flag=True, help='Indent viewed events')
 @click.pass_context
-def collect_events(ctx, host_id, query, index, rta_name, rule_id, view_events):
+def collect_events(ctx, host_id, query, index, rta_name, rule_id, view_events, pretty):
     """Collect events from Elasticsearch."""
     client: Elasticsearch = ctx.obj['es']
     dsl = kql.to_dsl(query) if query else MATCH_ALL
@@ -382,7 +449,7 @@ def collect_events(ctx, host_id, query, index, rta_name, rule_id, view_events):
             events.evaluate_against_rule_and_update_mapping(rule_id, rta_name)
 
         if view_events and events.events:
-            events.echo_events(pager=True)
+            events.echo_events(pager=True, pretty=pretty)
 
         return events
     except AssertionError as e:
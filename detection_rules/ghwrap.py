@@ -22,6 +22,7 @@ import requests
 from requests import Response
 
 from .schemas import definitions
+from .utils import download_zip
 
 # this is primarily for type hinting - all use of the github client should come from GithubClient class
 try:
@@ -86,17 +87,13 @@ def load_json_gh_asset(url: str) -> dict:
 
 def download_gh_asset(url: str, path: str, overwrite=False):
     """Download and unzip a GitHub asset."""
-    zipped = requests.get(url)
-    z = ZipFile(io.BytesIO(zipped.content))
+    with download_zip(url) as z:
+        Path(path).mkdir(exist_ok=True)
+        if overwrite:
+            shutil.rmtree(path, ignore_errors=True)
 
-    Path(path).mkdir(exist_ok=True)
-    if overwrite:
-        shutil.rmtree(path, ignore_errors=True)
-
-    z.extractall(path)
-    click.echo(f'files saved to {path}')
-
-    z.close()
+        z.extractall(path)
+        click.echo(f'files saved to {path}')
 
 
 def update_gist(token: str,
@@ -4,11 +4,11 @@
 # 2.0.
 
 """Functions to support and interact with Kibana integrations."""
+import functools
 import glob
 import gzip
 import json
 import re
-from collections import OrderedDict
 from pathlib import Path
 from typing import Generator, Tuple, Union, Optional
 
@@ -22,7 +22,7 @@ import kql
 from . import ecs
 from .beats import flatten_ecs_schema
 from .misc import load_current_package_version
-from .utils import cached, get_etc_path, read_gzip, unzip
+from .utils import cached, download_zip, get_etc_path, load_gzip_json
 
 MANIFEST_FILE_PATH = Path(get_etc_path('integration-manifests.json.gz'))
 SCHEMA_FILE_PATH = Path(get_etc_path('integration-schemas.json.gz'))
@@ -31,13 +31,13 @@ SCHEMA_FILE_PATH = Path(get_etc_path('integration-schemas.json.gz'))
 @cached
 def load_integrations_manifests() -> dict:
     """Load the consolidated integrations manifest."""
-    return json.loads(read_gzip(get_etc_path('integration-manifests.json.gz')))
+    return load_gzip_json(get_etc_path('integration-manifests.json.gz'))
 
 
 @cached
 def load_integrations_schemas() -> dict:
     """Load the consolidated integrations schemas."""
-    return json.loads(read_gzip(get_etc_path('integration-schemas.json.gz')))
+    return load_gzip_json(get_etc_path('integration-schemas.json.gz'))
 
 
 class IntegrationManifestSchema(Schema):
@@ -63,11 +63,12 @@ def build_integrations_manifest(overwrite: bool, rule_integrations: list) -> Non
             MANIFEST_FILE_PATH.unlink()
 
     final_integration_manifests = {integration: {} for integration in rule_integrations}
+    manifest_schema = IntegrationManifestSchema(unknown=EXCLUDE)
 
     for integration in rule_integrations:
         integration_manifests = get_integration_manifests(integration)
         for manifest in integration_manifests:
-            validated_manifest = IntegrationManifestSchema(unknown=EXCLUDE).load(manifest)
+            validated_manifest = manifest_schema.load(manifest)
             package_version = validated_manifest.pop("version")
             final_integration_manifests[integration][package_version] = validated_manifest
 
@@ -102,21 +103,19 @@ def build_integrations_schemas(overwrite: bool) -> None:
 
             # Download the zip file
             download_url = f"https://epr.elastic.co{manifest['download']}"
-            response = requests.get(download_url)
-            response.raise_for_status()
 
             # Update the final integration schemas
             final_integration_schemas[package].update({version: {}})
 
-            # Open the zip file
-            with unzip(response.content) as zip_ref:
-                for file in zip_ref.namelist():
+            # Stream the zip file to disk and open it
+            with download_zip(download_url) as zip_ref:
+                for member in zip_ref.infolist():
                     # Check if the file is a match
-                    if glob.fnmatch.fnmatch(file, '*/fields/*.yml'):
-                        integration_name = Path(file).parent.parent.name
+                    if glob.fnmatch.fnmatch(member.filename, '*/fields/*.yml'):
+                        integration_name = Path(member.filename).parent.parent.name
                         final_integration_schemas[package][version].setdefault(integration_name, {})
-                        file_data = zip_ref.read(file)
-                        schema_fields = yaml.safe_load(file_data)
+                        with zip_ref.open(member) as f:
+                            schema_fields = yaml.safe_load(f)
 
                         # Parse the schema and add to the integration_manifests
                         data = flatten_ecs_schema(schema_fields)
@@ -134,27 +133,35 @@ def build_integrations_schemas(overwrite: bool) -> None:
     print(f"final integrations manifests dumped: {SCHEMA_FILE_PATH}")
 
 
+@functools.lru_cache(maxsize=None)
+def get_sorted_versions(versions: Tuple[str, ...]) -> Tuple[Tuple[str, Version], ...]:
+    """Parse and sort a set of package versions, once per distinct set."""
+    return tuple(sorted(((version, Version.parse(version)) for version in versions), key=lambda x: x[1]))
+
+
+@functools.lru_cache(maxsize=None)
+def get_kibana_versions(version_requirement: str) -> Tuple[Version, ...]:
+    """Parse the kibana versions from a manifest version condition."""
+    return tuple(Version.parse(v) for v in re.sub(r"\>|\<|\=|\^", "", version_requirement).split(" || "))
+
+
 def find_least_compatible_version(package: str, integration: str,
                                   current_stack_version: str, packages_manifest: dict) -> str:
     """Finds least compatible version for specified integration based on stack version supplied."""
-    integration_manifests = {k: v for k, v in sorted(packages_manifest[package].items(),
-                             key=lambda x: Version.parse(x[0]))}
+    package_manifest = packages_manifest[package]
+    integration_versions = get_sorted_versions(tuple(package_manifest))
     current_stack_version = Version.parse(current_stack_version, optional_minor_and_patch=True)
 
     # filter integration_manifests to only the latest major entries
-    major_versions = sorted(list(set([Version.parse(manifest_version).major
-                            for manifest_version in integration_manifests])), reverse=True)
+    major_versions = sorted(set(parsed.major for _, parsed in integration_versions), reverse=True)
     for max_major in major_versions:
-        major_integration_manifests = \
-            {k: v for k, v in integration_manifests.items() if Version.parse(k).major == max_major}
-
         # iterates through ascending integration manifests
         # returns latest major version that is least compatible
-        for version, manifest in OrderedDict(sorted(major_integration_manifests.items(),
-                                                    key=lambda x: Version.parse(x[0]))).items():
-            compatible_versions = re.sub(r"\>|\<|\=|\^", "", manifest["conditions"]["kibana"]["version"]).split(" || ")
-            for kibana_ver in compatible_versions:
-                kibana_ver = Version.parse(kibana_ver)
+        for version, parsed in integration_versions:
+            if parsed.major != max_major:
+                continue
+
+            for kibana_ver in get_kibana_versions(package_manifest[version]["conditions"]["kibana"]["version"]):
                 # check versions have the same major
                 if kibana_ver.major == current_stack_version.major:
                     if kibana_ver <= current_stack_version:
@@ -15,6 +15,8 @@ from typing import NoReturn
 
 import click
 import requests
+from elasticsearch.exceptions import SerializationError
+from elasticsearch.serializer import JSONSerializer
 
 # this is primarily for type hinting - all use of the github client should come from GithubClient class
 try:
@@ -29,7 +31,7 @@ except ImportError:
     GitRelease = None  # noqa: N806
     GitReleaseAsset = None  # noqa: N806
 
-from .utils import add_params, cached, get_path, load_etc_dump
+from .utils import add_params, cached, get_path, load_etc_dump, orjson
 
 _CONFIG = {}
 
@@ -293,6 +295,32 @@ def getdefault(name):
     return lambda: os.environ.get(envvar, config.get(name))
 
 
+class OrjsonSerializer(JSONSerializer):
+    """Elasticsearch transport serializer backed by orjson."""
+
+    def loads(self, data):
+        # some responses have a json content type without any data
+        if data in (b'', ''):
+            return None
+
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError as e:
+            raise SerializationError(f'Unable to deserialize as JSON: {data!r}', errors=(e,))
+
+    def dumps(self, data) -> bytes:
+        # the body may already be encoded
+        if isinstance(data, str):
+            return data.encode('utf-8', 'surrogatepass')
+        elif isinstance(data, bytes):
+            return data
+
+        try:
+            return orjson.dumps(data, default=self.default)
+        except TypeError as e:
+            raise SerializationError(f'Unable to serialize to JSON: {data!r}', errors=(e,))
+
+
 def get_elasticsearch_client(cloud_id=None, elasticsearch_url=None, es_user=None, es_password=None, ctx=None, **kwargs):
     """Get an authenticated elasticsearch client."""
     from elasticsearch import AuthenticationException, Elasticsearch
@@ -307,6 +335,11 @@ def get_elasticsearch_client(cloud_id=None, elasticsearch_url=None, es_user=None
     timeout = kwargs.pop('timeout', 60)
     kwargs['verify_certs'] = not kwargs.pop('ignore_ssl_errors', False)
 
+    # use the faster orjson backed serializer when it is available
+    if 'serializer' not in kwargs:
+        if orjson is not None:
+            kwargs['serializer'] = OrjsonSerializer()
+
     try:
         client = Elasticsearch(hosts=hosts, cloud_id=cloud_id, http_auth=(es_user, es_password), timeout=timeout,
                                **kwargs)
@@ -19,7 +19,7 @@ from .misc import load_current_package_version
 from .schemas import definitions
 from .schemas.stack_compat import get_incompatible_fields
 from semver import Version
-from .utils import cached, dict_hash
+from .utils import cached, dict_hash, loads_json, read_mapped
 
 T = TypeVar('T')
 ClassT = TypeVar('ClassT')  # bound=dataclass?
@@ -157,7 +157,8 @@ class LockDataclassMixin:
     def load_from_file(cls: Type[ClassT], lock_file: Optional[Path] = None) -> ClassT:
         """Load and validate a version lock file."""
         path: Path = getattr(cls, 'file_path', lock_file)
-        contents = json.loads(path.read_text())
+        with read_mapped(path) as data:
+            contents = loads_json(data)
         loaded = cls.from_dict(dict(data=contents))
         return loaded
 
@@ -180,13 +181,18 @@ class StackCompatMixin:
     @validates_schema
     def validate_field_compatibility(self, data: dict, **kwargs):
         """Verify stack-specific fields are properly applied to schema."""
-        package_version = Version.parse(load_current_package_version(), optional_minor_and_patch=True)
-        schema_fields = getattr(self, 'fields', {})
-        incompatible = get_incompatible_fields(list(schema_fields.values()), package_version)
+        # a schema's fields are fixed, so only resolve the incompatible ones once per schema and package version
+        package_version = load_current_package_version()
+        cached_version, incompatible = getattr(self, '_incompatible_fields', (None, None))
+        if cached_version != package_version:
+            schema_fields = getattr(self, 'fields', {})
+            incompatible = get_incompatible_fields(list(schema_fields.values()),
+                                                   Version.parse(package_version, optional_minor_and_patch=True))
+            self._incompatible_fields = (package_version, incompatible)
+
         if not incompatible:
             return
 
-        package_version = load_current_package_version()
         for field, bounds in incompatible.items():
             min_compat, max_compat = bounds
             if data.get(field) is not None:
@@ -4,16 +4,19 @@
 # 2.0.
 
 """Packaging and preparation for releases."""
-import base64
 import datetime
 import hashlib
 import json
 import os
 import shutil
+import sys
+import tempfile
 import textwrap
-from collections import defaultdict
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, Optional, Tuple
+from typing import Dict, Iterable, Iterator, Optional, Tuple
 
 import click
 import yaml
@@ -35,23 +38,28 @@ FLEET_PKG_LOGO = get_etc_path("security-logo-color-64px.svg")
 # CHANGELOG_FILE = Path(get_etc_path('rules-changelog.json'))
 
 
-def filter_rule(rule: TOMLRule, config_filter: dict, exclude_fields: Optional[dict] = None) -> bool:
-    """Filter a rule based off metadata and a package configuration."""
+def _lower_values(values: Iterable) -> set:
+    """Get a set of values with any strings lowercased."""
+    return {v.lower() if isinstance(v, str) else v for v in values}
+
+
+def normalize_filter(config_filter: dict) -> Dict[str, set]:
+    """Normalize the values of a package filter configuration for use with filter_rule."""
+    return {key: _lower_values(values) for key, values in config_filter.items()}
+
+
+def filter_rule(rule: TOMLRule, config_filter: Dict[str, set], exclude_fields: Optional[dict] = None) -> bool:
+    """Filter a rule based off metadata and a package configuration normalized with normalize_filter."""
     flat_rule = rule.contents.flattened_dict()
 
     for key, values in config_filter.items():
         if key not in flat_rule:
             return False
 
-        values = set([v.lower() if isinstance(v, str) else v for v in values])
         rule_value = flat_rule[key]
+        rule_values = _lower_values(rule_value if isinstance(rule_value, list) else [rule_value])
 
-        if isinstance(rule_value, list):
-            rule_values = {v.lower() if isinstance(v, str) else v for v in rule_value}
-        else:
-            rule_values = {rule_value.lower() if isinstance(rule_value, str) else rule_value}
-
-        if len(rule_values & values) == 0:
+        if rule_values.isdisjoint(values):
             return False
 
     exclude_fields = exclude_fields or {}
@@ -68,6 +76,26 @@ def filter_rule(rule: TOMLRule, config_filter: dict, exclude_fields: Optional[di
     return True
 
 
+def _zip_directory(archive_path: str, directory: str, compresslevel: int = 1):
+    """Zip a directory under its own name, storing any nested archives uncompressed."""
+    directory = Path(directory)
+
+    with zipfile.ZipFile(archive_path, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=compresslevel) as zf:
+        for path in [directory, *sorted(directory.rglob('*'))]:
+            compress_type = zipfile.ZIP_STORED if path.suffix == '.zip' else None
+            zf.write(path, path.relative_to(directory.parent), compress_type=compress_type)
+
+
+def in_version_range(rule: TOMLRule, min_version: Optional[int] = None, max_version: Optional[int] = None) -> bool:
+    """Check if the latest version of a rule is within the (inclusive) version bounds."""
+    if min_version is None and max_version is None:
+        return True
+
+    latest_version = rule.contents.latest_version
+    return (min_version is None or min_version <= latest_version) and \
+        (max_version is None or max_version >= latest_version)
+
+
 CURRENT_RELEASE_PATH = Path(RELEASE_DIR) / load_current_package_version()
 
 
@@ -85,12 +113,10 @@ class Package(object):
         self.release = release
         self.registry_data = registry_data or {}
         self.generate_navigator = generate_navigator
+        self._package_hashes: Dict[bool, str] = {}
 
-        if min_version is not None:
-            self.rules = self.rules.filter(lambda r: min_version <= r.contents.latest_version)
-
-        if max_version is not None:
-            self.rules = self.rules.filter(lambda r: max_version >= r.contents.latest_version)
+        if min_version is not None or max_version is not None:
+            self.rules = self.rules.filter(lambda r: in_version_range(r, min_version, max_version))
 
         self.changed_ids, self.new_ids, self.removed_ids = \
             default_version_lock.manage_versions(self.rules, verbose=verbose, save_changes=False)
@@ -114,26 +140,22 @@ class Package(object):
 
     def _package_kibana_index_file(self, save_dir):
         """Convert and save index file with package."""
-        sorted_rules = sorted(self.rules, key=lambda k: (k.contents.metadata.creation_date, os.path.basename(k.path)))
+        sorted_rules = sorted(self.rules, key=lambda k: (k.contents.metadata.creation_date, k.basename))
         comments = [
             '// Auto generated file from either:',
             '// - scripts/regen_prepackage_rules_index.sh',
             '// - detection-rules repo using CLI command build-release',
             '// Do not hand edit. Run script/command to regenerate package information instead',
         ]
-        rule_imports = [f"import rule{i} from './{os.path.splitext(os.path.basename(r.path))[0] + '.json'}';"
-                        for i, r in enumerate(sorted_rules, 1)]
+        rule_imports = []
         const_exports = ['export const rawRules = [']
-        const_exports.extend(f"  rule{i}," for i, _ in enumerate(sorted_rules, 1))
-        const_exports.append("];")
-        const_exports.append("")
 
-        index_ts = [JS_LICENSE, ""]
-        index_ts.extend(comments)
-        index_ts.append("")
-        index_ts.extend(rule_imports)
-        index_ts.append("")
-        index_ts.extend(const_exports)
+        for i, rule in enumerate(sorted_rules, 1):
+            rule_imports.append(f"import rule{i} from './{rule.path.stem}.json';")
+            const_exports.append(f"  rule{i},")
+
+        const_exports.extend(["];", ""])
+        index_ts = [JS_LICENSE, "", *comments, "", *rule_imports, "", *const_exports]
 
         with open(os.path.join(save_dir, 'index.ts'), 'wt') as f:
             f.write('\n'.join(index_ts))
@@ -149,9 +171,9 @@ class Package(object):
         if self.generate_navigator:
             self.generate_attack_navigator(Path(directory))
 
-        consolidated = json.loads(self.get_consolidated())
+        consolidated = [rule.contents.to_api_format() for rule in self.rules]
         with open(os.path.join(directory, f'{self.name}-consolidated-rules.json'), 'w') as f:
-            json.dump(consolidated, f, sort_keys=True, indent=2)
+            f.write(json.dumps(consolidated, sort_keys=True, indent=2))
         consolidated_rules = Ndjson(consolidated)
         consolidated_rules.dump(Path(directory).joinpath(f'{self.name}-consolidated-rules.ndjson'), sort_keys=True)
 
@@ -163,13 +185,19 @@ class Package(object):
         rules_ndjson.dump(Path(directory).joinpath(f'{self.name}-enriched-rules-index-importable.ndjson'),
                           sort_keys=True)
 
+    def iter_consolidated(self, as_api=True) -> Iterator[str]:
+        """Iterate over the consolidated package of the rules as JSON fragments, one per rule."""
+        yield '['
+
+        for i, rule in enumerate(self.rules):
+            contents = rule.contents.to_api_format() if as_api else rule.contents.to_dict()
+            yield (', ' if i else '') + json.dumps(contents, sort_keys=True)
+
+        yield ']'
+
     def get_consolidated(self, as_api=True):
         """Get a consolidated package of the rules in a single file."""
-        full_package = []
-        for rule in self.rules:
-            full_package.append(rule.contents.to_api_format() if as_api else rule.contents.to_dict())
-
-        return json.dumps(full_package, sort_keys=True)
+        return ''.join(self.iter_consolidated(as_api=as_api))
 
     def save(self, verbose=True):
         """Save a package and all artifacts."""
@@ -177,13 +205,16 @@ class Package(object):
         rules_dir = os.path.join(save_dir, 'rules')
         extras_dir = os.path.join(save_dir, 'extras')
 
-        # remove anything that existed before
-        shutil.rmtree(save_dir, ignore_errors=True)
+        # remove anything that existed before - move it aside so the slow recursive delete can run in the background
+        if os.path.exists(save_dir):
+            stale_dir = tempfile.mkdtemp(prefix=f'.{self.name}-stale-', dir=RELEASE_DIR)
+            os.rename(save_dir, os.path.join(stale_dir, self.name))
+            threading.Thread(target=shutil.rmtree, args=(stale_dir,), kwargs=dict(ignore_errors=True)).start()
         os.makedirs(rules_dir, exist_ok=True)
         os.makedirs(extras_dir, exist_ok=True)
 
-        for rule in self.rules:
-            rule.save_json(Path(rules_dir).joinpath(rule.path.name).with_suffix('.json'))
+        with ThreadPoolExecutor() as executor:
+            list(executor.map(lambda r: r.save_json(Path(rules_dir).joinpath(r.path.name)), self.rules))
 
         self._package_kibana_notice_file(rules_dir)
         self._package_kibana_index_file(rules_dir)
@@ -193,12 +224,10 @@ class Package(object):
             self.save_release_files(extras_dir, self.changed_ids, self.new_ids, self.removed_ids)
 
             # zip all rules only and place in extras
-            shutil.make_archive(os.path.join(extras_dir, self.name), 'zip', root_dir=os.path.dirname(rules_dir),
-                                base_dir=os.path.basename(rules_dir))
+            _zip_directory(os.path.join(extras_dir, f'{self.name}.zip'), rules_dir)
 
             # zip everything and place in release root
-            shutil.make_archive(os.path.join(save_dir, '{}-all'.format(self.name)), 'zip',
-                                root_dir=os.path.dirname(extras_dir), base_dir=os.path.basename(extras_dir))
+            _zip_directory(os.path.join(save_dir, f'{self.name}-all.zip'), extras_dir)
 
         if verbose:
             click.echo('Package saved to: {}'.format(save_dir))
@@ -212,8 +241,16 @@ class Package(object):
 
     def get_package_hash(self, as_api=True, verbose=True):
         """Get hash of package contents."""
-        contents = base64.b64encode(self.get_consolidated(as_api=as_api).encode('utf-8'))
-        sha256 = hashlib.sha256(contents).hexdigest()
+        # the rules are fixed once the package is built, so only hash the consolidated contents once
+        if as_api not in self._package_hashes:
+            # the hash only identifies the package contents, so let OpenSSL use any sha256 implementation (3.9+)
+            package_hash = hashlib.sha256(**({'usedforsecurity': False} if sys.version_info >= (3, 9) else {}))
+            for fragment in self.iter_consolidated(as_api=as_api):
+                package_hash.update(fragment.encode('utf-8'))
+
+            self._package_hashes[as_api] = package_hash.hexdigest()
+
+        sha256 = self._package_hashes[as_api]
 
         if verbose:
             click.echo('- sha256: {}'.format(sha256))
@@ -228,9 +265,15 @@ class Package(object):
         exclude_fields = config.pop('exclude_fields', {})
         # deprecated rules are now embedded in the RuleCollection.deprecated - this is left here for backwards compat
         config.pop('log_deprecated', False)
-        rule_filter = config.pop('filter', {})
+        rule_filter = normalize_filter(config.pop('filter', {}))
+        min_version = config.pop('min_version', None)
+        max_version = config.pop('max_version', None)
 
-        rules = all_rules.filter(lambda r: filter_rule(r, rule_filter, exclude_fields))
+        # apply the version bounds in the same pass, rather than filtering the collection again when initializing
+        def include_rule(r: TOMLRule) -> bool:
+            return filter_rule(r, rule_filter, exclude_fields) and in_version_range(r, min_version, max_version)
+
+        rules = all_rules.filter(include_rule)
 
         # add back in deprecated fields
         rules.deprecated = all_rules.deprecated
@@ -246,37 +289,42 @@ class Package(object):
         """Generate stats on package."""
         from string import ascii_lowercase, ascii_uppercase
 
-        summary = {
-            'changed': defaultdict(list),
-            'added': defaultdict(list),
-            'removed': defaultdict(list),
-            'unchanged': defaultdict(list)
-        }
-        changelog = {
-            'changed': defaultdict(list),
-            'added': defaultdict(list),
-            'removed': defaultdict(list),
-            'unchanged': defaultdict(list)
-        }
+        changed_rule_ids = set(changed_rule_ids)
+        new_rule_ids = set(new_rule_ids)
+        removed_rules = set(removed_rules)
 
-        # build an index map first
+        summary = {'changed': {}, 'added': {}, 'removed': {}, 'unchanged': {}}
+        changelog = {'changed': {}, 'added': {}, 'removed': {}, 'unchanged': {}}
+
+        # build an index map and bucket the rules in the same pass
         longest_name = 0
         indexes = set()
+        bucketed_rules = []
         for rule in self.rules:
             longest_name = max(longest_name, len(rule.name))
-            index_list = getattr(rule.contents.data, "index", [])
-            if index_list:
-                indexes.update(index_list)
+            index_list = tuple(getattr(rule.contents.data, "index", None) or [])
+            indexes.update(index_list)
+
+            if rule.id in changed_rule_ids:
+                bucketed_rules.append(('changed', rule, index_list))
+            elif rule.id in new_rule_ids:
+                bucketed_rules.append(('added', rule, index_list))
+            else:
+                bucketed_rules.append(('unchanged', rule, index_list))
 
         letters = ascii_uppercase + ascii_lowercase
         index_map = {index: letters[i] for i, index in enumerate(sorted(indexes))}
 
-        def get_summary_rule_info(r: TOMLRule):
+        # most rules share the same few index lists, so only map each distinct list to its letters once
+        index_letters = {index_list: ''.join(index_map[idx] for idx in index_list) or 'none'
+                         for index_list in set(index_list for _, _, index_list in bucketed_rules)}
+
+        def get_summary_rule_info(r: TOMLRule, index_list: tuple):
             r = r.contents
             rule_str = f'{r.name:<{longest_name}} (v:{r.autobumped_version} t:{r.data.type}'
-            if isinstance(rule.contents.data, QueryRuleData):
+            if isinstance(r.data, QueryRuleData):
                 rule_str += f'-{r.data.language}'
-                rule_str += f'(indexes:{"".join(index_map[idx] for idx in rule.contents.data.index) or "none"}'
+                rule_str += f'(indexes:{index_letters[index_list]}'
 
             return rule_str
 
@@ -285,54 +333,48 @@ class Package(object):
             data = r.contents.data
             rules_dir_link = f'https://github.com/elastic/detection-rules/tree/v{self.name}/rules/{sd}/'
             rule_type = data.language if isinstance(data, QueryRuleData) else data.type
-            return f'`{r.id}` **[{r.name}]({rules_dir_link + os.path.basename(str(r.path))})** (_{rule_type}_)'
+            return f'`{r.id}` **[{r.name}]({rules_dir_link + r.basename})** (_{rule_type}_)'
 
-        for rule in self.rules:
-            sub_dir = os.path.basename(os.path.dirname(rule.path))
-
-            if rule.id in changed_rule_ids:
-                summary['changed'][sub_dir].append(get_summary_rule_info(rule))
-                changelog['changed'][sub_dir].append(get_markdown_rule_info(rule, sub_dir))
-            elif rule.id in new_rule_ids:
-                summary['added'][sub_dir].append(get_summary_rule_info(rule))
-                changelog['added'][sub_dir].append(get_markdown_rule_info(rule, sub_dir))
-            else:
-                summary['unchanged'][sub_dir].append(get_summary_rule_info(rule))
-                changelog['unchanged'][sub_dir].append(get_markdown_rule_info(rule, sub_dir))
+        # the formatted strings depend on the index map, so they can only be built once all rules are seen
+        for bucket, rule, index_list in bucketed_rules:
+            sub_dir = rule.subdir
+            summary[bucket].setdefault(sub_dir, []).append(get_summary_rule_info(rule, index_list))
+            changelog[bucket].setdefault(sub_dir, []).append(get_markdown_rule_info(rule, sub_dir))
 
         for rule in self.deprecated_rules:
-            sub_dir = os.path.basename(os.path.dirname(rule.path))
-
             if rule.id in removed_rules:
-                summary['removed'][sub_dir].append(rule.name)
-                changelog['removed'][sub_dir].append(rule.name)
-
-        def format_summary_rule_str(rule_dict):
-            str_fmt = ''
-            for sd, rules in sorted(rule_dict.items(), key=lambda x: x[0]):
-                str_fmt += f'\n{sd} ({len(rules)})\n'
-                str_fmt += '\n'.join(' - ' + s for s in sorted(rules))
-            return str_fmt or '\nNone'
-
-        def format_changelog_rule_str(rule_dict):
-            str_fmt = ''
-            for sd, rules in sorted(rule_dict.items(), key=lambda x: x[0]):
-                str_fmt += f'\n- **{sd}** ({len(rules)})\n'
-                str_fmt += '\n'.join('   - ' + s for s in sorted(rules))
-            return str_fmt or '\nNone'
+                sub_dir = rule.subdir
+                summary['removed'].setdefault(sub_dir, []).append(rule.name)
+                changelog['removed'].setdefault(sub_dir, []).append(rule.name)
+
+        # summary and changelog share the same subdirs per bucket, so sort them once
+        sorted_subdirs = {sf: sorted(rule_dict) for sf, rule_dict in summary.items()}
+
+        def format_rule_str(rule_dict, subdirs, subdir_fmt, prefix):
+            parts = []
+            for sd in subdirs:
+                parts.append(subdir_fmt.format(sd=sd, count=len(rule_dict[sd])))
+                parts.append('\n'.join(prefix + s for s in sorted(rule_dict[sd])))
+            return ''.join(parts) or '\nNone'
 
         def rule_count(rule_dict):
-            count = 0
-            for _, rules in rule_dict.items():
-                count += len(rules)
-            return count
+            return sum(len(rules) for rules in rule_dict.values())
 
         today = str(datetime.date.today())
-        summary_fmt = [f'{sf.capitalize()} ({rule_count(summary[sf])}): \n{format_summary_rule_str(summary[sf])}\n'
-                       for sf in ('added', 'changed', 'removed', 'unchanged') if summary[sf]]
+        summary_fmt = []
+        change_fmt = []
+
+        for sf in ('added', 'changed', 'removed', 'unchanged'):
+            if not summary[sf]:
+                continue
+
+            count = rule_count(summary[sf])
+            rule_str = format_rule_str(summary[sf], sorted_subdirs[sf], '\n{sd} ({count})\n', ' - ')
+            summary_fmt.append(f'{sf.capitalize()} ({count}): \n{rule_str}\n')
 
-        change_fmt = [f'{sf.capitalize()} ({rule_count(changelog[sf])}): \n{format_changelog_rule_str(changelog[sf])}\n'
-                      for sf in ('added', 'changed', 'removed') if changelog[sf]]
+            if sf != 'unchanged':
+                rule_str = format_rule_str(changelog[sf], sorted_subdirs[sf], '\n- **{sd}** ({count})\n', '   - ')
+                change_fmt.append(f'{sf.capitalize()} ({count}): \n{rule_str}\n')
 
         summary_str = '\n'.join([
             f'Version {self.name}',
@@ -398,10 +440,13 @@ class Package(object):
         shutil.copyfile(FLEET_PKG_LOGO, logo_file)
         # shutil.copyfile(CHANGELOG_FILE, str(rules_dir.joinpath('CHANGELOG.json')))
 
-        for rule in self.rules:
+        def save_asset(rule: TOMLRule):
             asset_path = rules_dir / f'{rule.id}.json'
             asset_path.write_text(json.dumps(rule.get_asset(), indent=4, sort_keys=True), encoding="utf-8")
 
+        with ThreadPoolExecutor() as executor:
+            list(executor.map(save_asset, self.rules))
+
         notice_contents = Path(NOTICE_FILE).read_text()
         readme_text = textwrap.dedent("""
         # Prebuilt Security Detection Rules
@@ -31,7 +31,8 @@ from .misc import load_current_package_version
 from .mixins import MarshmallowDataclassMixin, StackCompatMixin
 from .rule_formatter import nested_normalize, toml_write
 from .schemas import (SCHEMA_DIR, definitions, downgrade,
-                      get_min_supported_stack_version, get_stack_schemas)
+                      get_min_supported_stack_version, get_stack_schemas,
+                      parse_stack_version)
 from .schemas.stack_compat import get_restricted_fields
 from .utils import cached
 
@@ -253,7 +254,7 @@ class BaseRuleData(MarshmallowDataclassMixin, StackCompatMixin):
 
     @property
     def is_elastic_rule(self):
-        return 'elastic' in [a.lower() for a in self.author]
+        return any(a.lower() == 'elastic' for a in self.author)
 
     def get_build_fields(self) -> {}:
         """Get a list of build-time fields along with the stack versions which they will build within."""
@@ -353,7 +354,7 @@ class QueryValidator:
     @cached
     def get_required_fields(self, index: str) -> List[dict]:
         """Retrieves fields needed for the query along with type information from the schema."""
-        current_version = Version.parse(load_current_package_version(), optional_minor_and_patch=True)
+        current_version = parse_stack_version(load_current_package_version())
         ecs_version = get_stack_schemas()[str(current_version)]['ecs']
         beats_version = get_stack_schemas()[str(current_version)]['beats']
         endgame_version = get_stack_schemas()[str(current_version)]['endgame']
@@ -678,7 +679,7 @@ class BaseRuleContents(ABC):
     @property
     def is_dirty(self) -> Optional[bool]:
         """Determine if the rule has changed since its version was locked."""
-        min_stack = Version.parse(self.get_supported_version(), optional_minor_and_patch=True)
+        min_stack = parse_stack_version(self.get_supported_version())
         existing_sha256 = self.version_lock.get_locked_hash(self.id, f"{min_stack.major}.{min_stack.minor}")
 
         if existing_sha256 is not None:
@@ -703,8 +704,8 @@ class BaseRuleContents(ABC):
         """Determine if the rule is in a forked version."""
         if not self.has_forked:
             return False
-        locked_min_stack = Version.parse(self.lock_entry['min_stack_version'], optional_minor_and_patch=True)
-        current_package_ver = Version.parse(load_current_package_version(), optional_minor_and_patch=True)
+        locked_min_stack = parse_stack_version(self.lock_entry['min_stack_version'])
+        current_package_ver = parse_stack_version(load_current_package_version())
         return current_package_ver < locked_min_stack
 
     def get_version_space(self) -> Optional[int]:
@@ -737,7 +738,7 @@ class BaseRuleContents(ABC):
         min_version = get_min_supported_stack_version()
         if stack_version is None:
             return min_version
-        return max(Version.parse(stack_version, optional_minor_and_patch=True), min_version)
+        return max(parse_stack_version(stack_version), min_version)
 
     def get_supported_version(self) -> str:
         """Get the lowest stack version for the rule that is currently supported in the form major.minor."""
@@ -761,11 +762,20 @@ class BaseRuleContents(ABC):
     def to_api_format(self, include_version=True) -> dict:
         """Convert the rule to the API format."""
 
-    @cached
     def sha256(self, include_version=False) -> str:
+        # the contents are frozen, so the version-less hash is memoized on the instance (circumventing frozen). The
+        # versioned hash depends on the version lock, which can change, so it is always recomputed.
+        if not include_version and '_sha256' in self.__dict__:
+            return self.__dict__['_sha256']
+
         # get the hash of the API dict without the version by default, otherwise it'll always be dirty.
         hashable_contents = self.to_api_format(include_version=include_version)
-        return utils.dict_hash(hashable_contents)
+        sha256 = utils.dict_hash(hashable_contents)
+
+        if not include_version:
+            self.__dict__['_sha256'] = sha256
+
+        return sha256
 
 
 @dataclass(frozen=True)
@@ -947,7 +957,7 @@ class TOMLRuleContents(BaseRuleContents, MarshmallowDataclassMixin):
     @staticmethod
     def compare_field_versions(min_stack: Version, max_stack: Version) -> bool:
         """Check current rule version is within min and max stack versions."""
-        current_version = Version.parse(load_current_package_version(), optional_minor_and_patch=True)
+        current_version = parse_stack_version(load_current_package_version())
         max_stack = max_stack or current_version
         return min_stack <= current_version >= max_stack
 
@@ -1002,12 +1012,17 @@ class TOMLRuleContents(BaseRuleContents, MarshmallowDataclassMixin):
         dict_obj = dict(metadata=metadata, rule=data)
         return nested_normalize(dict_obj)
 
-    def flattened_dict(self) -> dict:
+    @cached_property
+    def _flattened(self) -> dict:
         flattened = dict()
         flattened.update(self.data.to_dict())
         flattened.update(self.metadata.to_dict())
         return flattened
 
+    def flattened_dict(self) -> dict:
+        """Get the rule data and metadata as a single dict, built once per (frozen) contents. Do not modify."""
+        return self._flattened
+
     def to_api_format(self, include_version=True) -> dict:
         """Convert the TOML rule to the API format."""
         converted = self.data.to_dict()
@@ -1022,7 +1037,7 @@ class TOMLRuleContents(BaseRuleContents, MarshmallowDataclassMixin):
         """Check for compatibility between restricted fields and the min_stack_version of the rule."""
         default_min_stack = get_min_supported_stack_version()
         if self.metadata.min_stack_version is not None:
-            min_stack = Version.parse(self.metadata.min_stack_version, optional_minor_and_patch=True)
+            min_stack = parse_stack_version(self.metadata.min_stack_version)
         else:
             min_stack = default_min_stack
         restricted = self.data.get_restricted_fields
@@ -1051,6 +1066,16 @@ class TOMLRule:
     def name(self):
         return self.contents.data.name
 
+    @cached_property
+    def basename(self) -> str:
+        """Get the file name of the rule."""
+        return os.path.basename(self.path)
+
+    @cached_property
+    def subdir(self) -> str:
+        """Get the name of the directory containing the rule."""
+        return os.path.basename(os.path.dirname(self.path))
+
     def get_asset(self) -> dict:
         """Generate the relevant fleet compatible asset."""
         return {"id": self.id, "attributes": self.contents.to_api_format(), "type": definitions.SAVED_OBJECT_TYPE}
@@ -1063,7 +1088,7 @@ class TOMLRule:
     def save_json(self, path: Path, include_version: bool = True):
         path = path.with_suffix('.json')
         with open(str(path.absolute()), 'w', newline='\n') as f:
-            json.dump(self.contents.to_api_format(include_version=include_version), f, sort_keys=True, indent=2)
+            f.write(json.dumps(self.contents.to_api_format(include_version=include_version), sort_keys=True, indent=2))
             f.write('\n')
 
 
@@ -1133,6 +1158,11 @@ class DeprecatedRule(dict):
     def name(self) -> str:
         return self.contents.name
 
+    @cached_property
+    def subdir(self) -> str:
+        """Get the name of the directory containing the rule."""
+        return os.path.basename(os.path.dirname(self.path))
+
 
 def downgrade_contents_from_rule(rule: TOMLRule, target_version: str) -> dict:
     """Generate the downgraded contents from a rule."""
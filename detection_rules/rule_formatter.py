@@ -10,7 +10,6 @@ import io
 import json
 import textwrap
 import typing
-from collections import OrderedDict
 
 import toml
 
@@ -151,7 +150,7 @@ def toml_write(rule_contents, outfile=None):
 
     def order_rule(obj):
         if isinstance(obj, dict):
-            obj = OrderedDict(sorted(obj.items()))
+            obj = dict(sorted(obj.items()))
             for k, v in obj.items():
                 if isinstance(v, dict) or isinstance(v, list):
                     obj[k] = order_rule(v)
@@ -180,14 +179,14 @@ def toml_write(rule_contents, outfile=None):
             # if tags and isinstance(tags, list):
             #     contents['rule']["tags"] = list(sorted(set(tags)))
 
-        top = OrderedDict()
-        bottom = OrderedDict()
+        top = {}
+        bottom = {}
 
         for k in sorted(list(_contents)):
             v = _contents.pop(k)
 
             if isinstance(v, dict):
-                bottom[k] = OrderedDict(sorted(v.items()))
+                bottom[k] = dict(sorted(v.items()))
             elif isinstance(v, list):
                 if any([isinstance(value, (dict, list)) for value in v]):
                     bottom[k] = v
@@ -202,7 +201,7 @@ def toml_write(rule_contents, outfile=None):
             top.update({'query': "XXxXX"})
 
         top.update(bottom)
-        top = toml.dumps(OrderedDict({data: top}), encoder=encoder)
+        top = toml.dumps({data: top}, encoder=encoder)
 
         # we want to preserve the query format, but want to modify it in the context of encoded dump
         if query:
@@ -4,15 +4,18 @@
 # 2.0.
 
 """Load rule metadata transform between rule and api formats."""
-import io
-from collections import OrderedDict
+import multiprocessing
+import os
+import pickle
+import sys
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass, field
+from operator import attrgetter
 from pathlib import Path
 from subprocess import CalledProcessError
-from typing import Callable, Dict, Iterable, List, Optional, Union
+from typing import Callable, Dict, Hashable, Iterable, Iterator, List, Optional, Tuple, Union
 
 import click
-import pytoml
 from marshmallow.exceptions import ValidationError
 
 from . import utils
@@ -26,6 +29,107 @@ DEFAULT_RULES_DIR = Path(get_path("rules"))
 DEFAULT_DEPRECATED_DIR = DEFAULT_RULES_DIR / '_deprecated'
 RTA_DIR = get_path("rta")
 FILE_PATTERN = r'^([a-z0-9_])+\.(json|toml)$'
+MIN_PARALLEL_TOML_FILES = 32
+RULE_PARSE_CACHE_ENV = 'DR_RULE_PARSE_CACHE'
+MAX_LOADED_RULES = 4096
+
+
+def _parse_toml_file(path: Path) -> Optional[dict]:
+    """Parse a TOML file in a worker process, leaving any errors to be raised when it is loaded serially."""
+    try:
+        return utils.loads_toml(path.read_bytes())
+    except Exception:
+        return None
+
+
+def _walk_toml_files(directory: Path, recursive=True) -> Iterator[Path]:
+    """Find TOML files with os.scandir, which reuses the file type from each directory listing instead of a stat."""
+    directories = [directory]
+    while directories:
+        with os.scandir(directories.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        directories.append(entry.path)
+                elif entry.name.endswith('.toml'):
+                    yield Path(entry.path)
+
+
+class TomlParseCache:
+    """On-disk cache of parsed TOML files, keyed by the modification time and size of each file."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.entries: Dict[str, Tuple[Tuple[int, int], dict]] = {}
+        self.changed = False
+
+        if path.exists():
+            try:
+                with utils.read_mapped(path) as data:
+                    self.entries = pickle.loads(data)
+            except Exception:
+                # a corrupt or incompatible cache is rebuilt from scratch
+                self.entries = {}
+
+    @classmethod
+    def from_env(cls) -> Optional['TomlParseCache']:
+        """Get the parse cache from the file set in the environment, if any."""
+        cache_file = os.environ.get(RULE_PARSE_CACHE_ENV)
+        if cache_file:
+            return cls(Path(cache_file))
+
+    @staticmethod
+    def signature(path: Path) -> Tuple[int, int]:
+        stat = path.stat()
+        return stat.st_mtime_ns, stat.st_size
+
+    def get(self, path: Path, signature: Tuple[int, int]) -> Optional[dict]:
+        """Get the parsed contents of a file if it has not changed since it was cached."""
+        entry = self.entries.get(str(path))
+        if entry is not None and entry[0] == signature:
+            return entry[1]
+
+    def set(self, path: Path, signature: Tuple[int, int], contents: dict):
+        self.entries[str(path)] = (signature, contents)
+        self.changed = True
+
+    def save(self):
+        """Atomically write the cache back to disk if anything changed."""
+        if self.changed:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_name(f'{self.path.name}.{os.getpid()}.tmp')
+            tmp_path.write_bytes(pickle.dumps(self.entries, protocol=pickle.HIGHEST_PROTOCOL))
+            os.replace(tmp_path, self.path)
+            self.changed = False
+
+
+class LoadedRuleCache:
+    """In-memory LRU cache of loaded rule objects, keyed by path and checked against the file's modification time."""
+
+    def __init__(self, max_size: int = MAX_LOADED_RULES):
+        self.max_size = max_size
+        self.entries: Dict[Path, Tuple[Tuple[int, int], Union[TOMLRule, DeprecatedRule]]] = {}
+
+    def get(self, path: Path, signature: Tuple[int, int]) -> Optional[Union[TOMLRule, DeprecatedRule]]:
+        """Get the rule loaded from a file if the file has not changed since."""
+        entry = self.entries.pop(path, None)
+        if entry is not None and entry[0] == signature:
+            # reinsert to mark the entry as most recently used
+            self.entries[path] = entry
+            return entry[1]
+
+    def set(self, path: Path, signature: Tuple[int, int], rule: Union[TOMLRule, DeprecatedRule]):
+        self.entries.pop(path, None)
+        if len(self.entries) >= self.max_size:
+            del self.entries[next(iter(self.entries))]
+        self.entries[path] = (signature, rule)
+
+    def clear(self):
+        self.entries.clear()
+
+
+loaded_rule_cache = LoadedRuleCache()
+utils.on_clear_caches(loaded_rule_cache.clear)
 
 
 def path_getter(value: str) -> Callable[[dict], bool]:
@@ -73,6 +177,8 @@ def metadata_filter(**metadata) -> Callable[[TOMLRule], bool]:
         target_dict = rule.contents.metadata.to_dict()
         return flt(target_dict)
 
+    # frozen collections can answer single field criteria from their metadata index
+    callback.metadata = metadata
     return callback
 
 
@@ -170,6 +276,7 @@ class RuleCollection(BaseCollection):
 
         self._toml_load_cache: Dict[Path, dict] = {}
         self._version_lock: Optional[VersionLock] = None
+        self._metadata_index: Optional[Dict[str, Dict[Hashable, List[int]]]] = None
 
         for rule in (rules or []):
             self.add_rule(rule)
@@ -181,30 +288,102 @@ class RuleCollection(BaseCollection):
     def filter(self, cb: Callable[[TOMLRule], bool]) -> 'RuleCollection':
         """Retrieve a filtered collection of rules."""
         filtered_collection = RuleCollection()
+        rules = self._filter_metadata_index(getattr(cb, 'metadata', None))
+        add_rule = filtered_collection.add_rule
 
-        for rule in filter(cb, self.rules):
-            filtered_collection.add_rule(rule)
+        for rule in (filter(cb, self.rules) if rules is None else rules):
+            add_rule(rule)
 
         return filtered_collection
 
+    def _get_metadata_index(self) -> Dict[str, Dict[Hashable, List[int]]]:
+        """Map each metadata field and value to the positions of the rules with it."""
+        if self._metadata_index is None:
+            index = {}
+            present = {}
+            unindexable = set()
+
+            for position, rule in enumerate(self.rules):
+                for key, value in rule.contents.metadata.to_dict().items():
+                    present[key] = present.get(key, 0) + 1
+                    field_index = index.setdefault(key, {})
+                    for item in (value if isinstance(value, (list, set, tuple)) else [value]):
+                        if not isinstance(item, Hashable):
+                            unindexable.add(key)
+                            break
+                        positions = field_index.setdefault(item, [])
+                        if not positions or positions[-1] != position:
+                            positions.append(position)
+
+            # only index fields every rule has, so a lookup matches the scan exactly
+            self._metadata_index = {key: field_index for key, field_index in index.items()
+                                    if key not in unindexable and present[key] == len(self.rules)}
+
+        return self._metadata_index
+
+    def _filter_metadata_index(self, criteria: Optional[dict]) -> Optional[List[TOMLRule]]:
+        """Look up the rules matching a single metadata field in a frozen collection, if possible."""
+        if not self.frozen or not criteria or len(criteria) != 1:
+            return
+
+        (key, expected), = criteria.items()
+        field_index = self._get_metadata_index().get(key)
+        if field_index is None:
+            return
+
+        expected = expected if isinstance(expected, (list, set, tuple)) else [expected]
+        positions = set().union(*(field_index.get(value, []) for value in expected))
+        return [self.rules[position] for position in sorted(positions)]
+
     @staticmethod
     def deserialize_toml_string(contents: Union[bytes, str]) -> dict:
-        return pytoml.loads(contents)
+        return utils.loads_toml(contents)
 
     def _load_toml_file(self, path: Path) -> dict:
         if path in self._toml_load_cache:
             return self._toml_load_cache[path]
 
-        # use pytoml instead of toml because of annoying bugs
-        # https://github.com/uiri/toml/issues/152
-        # might also be worth looking at https://github.com/sdispater/tomlkit
-        with io.open(path, "r", encoding="utf-8") as f:
-            toml_dict = self.deserialize_toml_string(f.read())
-            self._toml_load_cache[path] = toml_dict
-            return toml_dict
+        # read the whole file in one call, rather than through a buffered text stream
+        toml_dict = self.deserialize_toml_string(path.read_bytes())
+        self._toml_load_cache[path] = toml_dict
+        return toml_dict
+
+    def _prefetch_toml_files(self, paths: List[Path]):
+        """Parse a batch of TOML files ahead of loading, reusing the on-disk parse cache if it is enabled."""
+        paths = [path for path in paths if path not in self._toml_load_cache]
+        parse_cache = TomlParseCache.from_env()
+
+        if parse_cache is not None:
+            # take the signatures before parsing, so a file edited mid-load is parsed again next time
+            signatures = {path: parse_cache.signature(path) for path in paths}
+            for path in paths:
+                toml_dict = parse_cache.get(path, signatures[path])
+                if toml_dict is not None:
+                    self._toml_load_cache[path] = toml_dict
+
+        unparsed = [path for path in paths if path not in self._toml_load_cache]
+
+        # parsing is CPU bound, so spread larger batches across multiple processes. only forked workers are cheap
+        # enough to start; spawned ones re-import the package and cost far more than a serial parse
+        can_fork = multiprocessing.get_start_method() == 'fork' and (os.cpu_count() or 1) > 1
+        if can_fork and len(unparsed) >= MIN_PARALLEL_TOML_FILES:
+            with ProcessPoolExecutor(mp_context=multiprocessing.get_context('fork')) as executor:
+                for path, toml_dict in zip(unparsed, executor.map(_parse_toml_file, unparsed, chunksize=16)):
+                    if toml_dict is not None:
+                        self._toml_load_cache[path] = toml_dict
+
+        if parse_cache is not None:
+            for path in unparsed:
+                toml_dict = self._toml_load_cache.get(path) or _parse_toml_file(path)
+                if toml_dict is not None:
+                    self._toml_load_cache[path] = toml_dict
+                    parse_cache.set(path, signatures[path], toml_dict)
+
+            parse_cache.save()
 
     def _get_paths(self, directory: Path, recursive=True) -> List[Path]:
-        return sorted(directory.rglob('*.toml') if recursive else directory.glob('*.toml'))
+        # resolve up front, matching the paths load_file() looks parsed files up by
+        return sorted(path.resolve() for path in _walk_toml_files(directory, recursive=recursive))
 
     def _assert_new(self, rule: Union[TOMLRule, DeprecatedRule], is_deprecated=False):
         if is_deprecated:
@@ -216,14 +395,16 @@ class RuleCollection(BaseCollection):
             file_map = self.file_map
             name_map = self.name_map
 
-        assert not self.frozen, f"Unable to add rule {rule.name} {rule.id} to a frozen collection"
-        assert rule.id not in id_map, \
-            f"Rule ID {rule.id} for {rule.name} collides with rule {id_map.get(rule.id).name}"
-        assert rule.name not in name_map, \
-            f"Rule Name {rule.name} for {rule.id} collides with rule ID {name_map.get(rule.name).id}"
+        # id and name are properties resolved through the contents, so look them up once
+        rule_id, rule_name, path = rule.id, rule.name, rule.path
+        assert not self.frozen, f"Unable to add rule {rule_name} {rule_id} to a frozen collection"
+        assert rule_id not in id_map, \
+            f"Rule ID {rule_id} for {rule_name} collides with rule {id_map.get(rule_id).name}"
+        assert rule_name not in name_map, \
+            f"Rule Name {rule_name} for {rule_id} collides with rule ID {name_map.get(rule_name).id}"
 
-        if rule.path is not None:
-            rule_path = rule.path.resolve()
+        if path is not None:
+            rule_path = path.resolve()
             assert rule_path not in file_map, f"Rule file {rule_path} already loaded"
             file_map[rule_path] = rule
 
@@ -240,6 +421,12 @@ class RuleCollection(BaseCollection):
         self.deprecated.rules.append(rule)
 
     def load_dict(self, obj: dict, path: Optional[Path] = None) -> Union[TOMLRule, DeprecatedRule]:
+        # intern the identifiers that key the id, name and version lock maps
+        rule_dict = obj.get('rule', {})
+        for key in ('rule_id', 'name', 'type'):
+            if isinstance(rule_dict.get(key), str):
+                rule_dict[key] = sys.intern(rule_dict[key])
+
         # bypass rule object load (load_dict) and load as a dict only
         if obj.get('metadata', {}).get('maturity', '') == 'deprecated':
             contents = DeprecatedRuleContents.from_dict(obj)
@@ -258,20 +445,21 @@ class RuleCollection(BaseCollection):
         try:
             path = path.resolve()
 
-            # use the default rule loader as a cache.
-            # if it already loaded the rule, then we can just use it from that
-            if self.__default is not None and self is not self.__default:
-                if path in self.__default.file_map:
-                    rule = self.__default.file_map[path]
-                    self.add_rule(rule)
-                    return rule
-                elif path in self.__default.deprecated.file_map:
-                    deprecated_rule = self.__default.deprecated.file_map[path]
-                    self.add_deprecated_rule(deprecated_rule)
-                    return deprecated_rule
-
-            obj = self._load_toml_file(path)
-            return self.load_dict(obj, path=path)
+            # rules loaded against the default version lock are shared by every collection until the file changes
+            if self._version_lock is not None:
+                return self.load_dict(self._load_toml_file(path), path=path)
+
+            signature = TomlParseCache.signature(path)
+            rule = loaded_rule_cache.get(path, signature)
+            if isinstance(rule, DeprecatedRule):
+                self.add_deprecated_rule(rule)
+            elif rule is not None:
+                self.add_rule(rule)
+            else:
+                rule = self.load_dict(self._load_toml_file(path), path=path)
+                loaded_rule_cache.set(path, signature, rule)
+
+            return rule
         except Exception:
             print(f"Error loading rule in {path}")
             raise
@@ -327,6 +515,16 @@ class RuleCollection(BaseCollection):
 
     def load_directory(self, directory: Path, recursive=True, toml_filter: Optional[Callable[[dict], bool]] = None):
         paths = self._get_paths(directory, recursive=recursive)
+
+        # rules already loaded from unchanged files are reused rather than parsed again
+        if toml_filter is not None or self._version_lock is not None:
+            self._prefetch_toml_files(paths)
+        else:
+            self._prefetch_toml_files([
+                path for path in paths
+                if loaded_rule_cache.get(path, TomlParseCache.signature(path)) is None
+            ])
+
         if toml_filter is not None:
             paths = [path for path in paths if toml_filter(self._load_toml_file(path))]
 
@@ -397,7 +595,6 @@ def load_github_pr_rules(labels: list = None, repo: str = 'elastic/detection-rul
     from multiprocessing.pool import ThreadPool
     from pathlib import Path
 
-    import pytoml
     import requests
 
     from .ghwrap import GithubClient
@@ -421,7 +618,7 @@ def load_github_pr_rules(labels: list = None, repo: str = 'elastic/detection-rul
         pull, rule_file = pr_info
         response = requests.get(rule_file.raw_url)
         try:
-            raw_rule = pytoml.loads(response.text)
+            raw_rule = utils.loads_toml(response.text)
             contents = TOMLRuleContents.from_dict(raw_rule)
             rule = TOMLRule(path=rule_file.filename, contents=contents)
             rule.gh_pr = pull
@@ -443,10 +640,11 @@ def load_github_pr_rules(labels: list = None, repo: str = 'elastic/detection-rul
     pool.close()
     pool.join()
 
-    new = OrderedDict([(rule.contents.id, rule) for rule in sorted(new_rules, key=lambda r: r.contents.name)])
-    modified = OrderedDict()
+    by_name = attrgetter('contents.name')
+    new = {rule.contents.id: rule for rule in sorted(new_rules, key=by_name)}
+    modified = {}
 
-    for modified_rule in sorted(modified_rules, key=lambda r: r.contents.name):
+    for modified_rule in sorted(modified_rules, key=by_name):
         modified.setdefault(modified_rule.contents.id, []).append(modified_rule)
 
     return new, modified, errors
@@ -458,6 +656,7 @@ __all__ = (
     "FILE_PATTERN",
     "DEFAULT_RULES_DIR",
     "load_github_pr_rules",
+    "loaded_rule_cache",
     "DeprecatedCollection",
     "DeprecatedRule",
     "RuleCollection",
@@ -2,11 +2,10 @@
 # or more contributor license agreements. Licensed under the Elastic License
 # 2.0; you may not use this file except in compliance with the Elastic License
 # 2.0.
+import functools
 import json
-from collections import OrderedDict
 from pathlib import Path
-from typing import List, Optional
-from typing import OrderedDict as OrderedDictType
+from typing import Dict, List, Optional, Tuple
 
 import jsonschema
 from semver import Version
@@ -23,6 +22,7 @@ __all__ = (
     "get_min_supported_stack_version",
     "get_stack_schemas",
     "get_stack_versions",
+    "parse_stack_version",
     "validate_rta_mapping",
     "all_versions",
 )
@@ -50,6 +50,12 @@ def migrate(version: str):
     return wrapper
 
 
+@functools.lru_cache(maxsize=None)
+def parse_stack_version(version: str) -> Version:
+    """Parse a stack version string, allowing the minor and patch to be omitted."""
+    return Version.parse(version, optional_minor_and_patch=True)
+
+
 @cached
 def get_schema_file(version: Version, rule_type: str) -> dict:
     path = Path(SCHEMA_DIR) / str(version) / f"{version}.{rule_type}.json"
@@ -60,6 +66,15 @@ def get_schema_file(version: Version, rule_type: str) -> dict:
     return json.loads(path.read_text(encoding="utf8"))
 
 
+@cached
+def get_schema_validator(version: Version, rule_type: str):
+    """Get a validator for a target schema, checking the schema itself only once."""
+    schema = get_schema_file(version, rule_type)
+    validator_cls = jsonschema.validators.validator_for(schema)
+    validator_cls.check_schema(schema)
+    return validator_cls(schema)
+
+
 def strip_additional_properties(version: Version, api_contents: dict) -> dict:
     """Remove all fields that the target schema doesn't recognize."""
     stripped = {}
@@ -70,7 +85,11 @@ def strip_additional_properties(version: Version, api_contents: dict) -> dict:
             stripped[field] = api_contents[field]
 
     # finally, validate against the json schema
-    jsonschema.validate(stripped, target_schema)
+    validator = get_schema_validator(version, api_contents["type"])
+    error = jsonschema.exceptions.best_match(validator.iter_errors(stripped))
+    if error is not None:
+        raise error
+
     return stripped
 
 
@@ -232,26 +251,36 @@ def migrate_to_8_7(version: Version, api_contents: dict) -> dict:
     return strip_additional_properties(version, api_contents)
 
 
-def downgrade(api_contents: dict, target_version: str, current_version: Optional[str] = None) -> dict:
-    """Downgrade a rule to a target stack version."""
-    from ..packaging import current_stack_version
-
-    if current_version is None:
-        current_version = current_stack_version()
-
-    current = Version.parse(current_version, optional_minor_and_patch=True)
-    target = Version.parse(target_version, optional_minor_and_patch=True)
+@cached
+def get_migration_path(target_version: str, current_version: str) -> Tuple[str, ...]:
+    """Get the ordered migrations needed to downgrade from the current to the target stack version."""
+    current = parse_stack_version(current_version)
+    target = parse_stack_version(target_version)
 
     # get all the versions between current_semver and target_semver
     if target.major != current.major:
         raise ValueError(f"Cannot backport to major version {target.major}")
 
+    path = []
     for minor in reversed(range(target.minor, current.minor)):
         version = f"{target.major}.{minor}"
         if version not in migrations:
             raise ValueError(f"Missing migration for {target_version}")
 
-        api_contents = migrations[str(version)](version, api_contents)
+        path.append(version)
+
+    return tuple(path)
+
+
+def downgrade(api_contents: dict, target_version: str, current_version: Optional[str] = None) -> dict:
+    """Downgrade a rule to a target stack version."""
+    from ..packaging import current_stack_version
+
+    if current_version is None:
+        current_version = current_stack_version()
+
+    for version in get_migration_path(target_version, current_version):
+        api_contents = migrations[version](version, api_contents)
 
     return api_contents
 
@@ -262,7 +291,7 @@ def load_stack_schema_map() -> dict:
 
 
 @cached
-def get_stack_schemas(stack_version: Optional[str] = '0.0.0') -> OrderedDictType[str, dict]:
+def get_stack_schemas(stack_version: Optional[str] = '0.0.0') -> Dict[str, dict]:
     """Return all ECS + beats to stack versions for every stack version >= specified stack version and <= package."""
     stack_version = Version.parse(stack_version or '0.0.0', optional_minor_and_patch=True)
     current_package = Version.parse(load_current_package_version(), optional_minor_and_patch=True)
@@ -275,7 +304,7 @@ def get_stack_schemas(stack_version: Optional[str] = '0.0.0') -> OrderedDictType
     if stack_version > current_package:
         versions[stack_version] = {'beats': 'main', 'ecs': 'master'}
 
-    versions_reversed = OrderedDict(sorted(versions.items(), reverse=True))
+    versions_reversed = dict(sorted(versions.items(), reverse=True))
     return versions_reversed
 
 
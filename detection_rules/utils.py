@@ -6,6 +6,7 @@
 """Util functions."""
 import base64
 import contextlib
+import copy
 import distutils.spawn
 import functools
 import glob
@@ -13,15 +14,18 @@ import gzip
 import hashlib
 import io
 import json
+import mmap
 import os
 import shutil
 import subprocess
+import sys
+import tempfile
 import time
 import zipfile
 from dataclasses import is_dataclass, astuple
 from datetime import datetime, date
 from pathlib import Path
-from typing import Dict, Union, Optional, Callable
+from typing import Dict, Iterator, Union, Optional, Callable
 
 import click
 import pytoml
@@ -30,10 +34,23 @@ from eql.utils import load_dump, stream_json_lines
 
 import kql
 
+try:
+    import orjson
+except ImportError:
+    # optional - fall back to the stdlib json module
+    orjson = None
+
+try:
+    import tomllib
+except ImportError:
+    # python < 3.11 - fall back to the pure python pytoml parser
+    tomllib = None
+
 CURR_DIR = os.path.dirname(os.path.abspath(__file__))
 ROOT_DIR = os.path.dirname(CURR_DIR)
 ETC_DIR = os.path.join(ROOT_DIR, "detection_rules", "etc")
 INTEGRATION_RULE_DIR = os.path.join(ROOT_DIR, "rules", "integrations")
+MMAP_MIN_SIZE = 16 * 1024
 
 
 class NonelessDict(dict):
@@ -85,6 +102,44 @@ def get_json_iter(f):
     return data
 
 
+def loads_toml(contents: Union[bytes, str]) -> dict:
+    """Deserialize a TOML document, preferring the faster stdlib parser when available."""
+    # use pytoml rather than toml as the fallback because of annoying bugs
+    # https://github.com/uiri/toml/issues/152
+    if isinstance(contents, bytes):
+        contents = contents.decode('utf-8')
+    return tomllib.loads(contents) if tomllib is not None else pytoml.loads(contents)
+
+
+def loads_json(data):
+    """Deserialize a JSON document."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data.tobytes() if isinstance(data, memoryview) else data)
+
+
+def dump_json_line(obj) -> bytes:
+    """Serialize an object to a sorted, newline terminated JSON line."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS | orjson.OPT_APPEND_NEWLINE)
+    # match the orjson output byte for byte, since saved events are committed as test data
+    return (json.dumps(obj, sort_keys=True, separators=(',', ':'), ensure_ascii=False) + '\n').encode('utf-8')
+
+
+def dumps_sorted(obj, pretty=True) -> str:
+    """Serialize an object to a sorted JSON string."""
+    if orjson is not None:
+        option = orjson.OPT_SORT_KEYS | (orjson.OPT_INDENT_2 if pretty else 0)
+        return orjson.dumps(obj, option=option).decode('utf-8')
+    return json.dumps(obj, indent=2 if pretty else None, sort_keys=True)
+
+
+def iter_json_lines(objs, pretty=False):
+    """Lazily serialize objects to sorted JSON, one object per line."""
+    for obj in objs:
+        yield dumps_sorted(obj, pretty=pretty) + '\n'
+
+
 def get_path(*paths) -> str:
     """Get a file by relative path."""
     return os.path.join(ROOT_DIR, *paths)
@@ -107,9 +162,23 @@ def get_etc_file(name, mode="r"):
         return f.read()
 
 
+@functools.lru_cache(maxsize=32)
+def _load_dump_by_stat(path: str, mtime_ns: int, size: int):
+    """Load a yml/toml file, keyed on its modification time and size so that edits are picked up."""
+    return eql.utils.load_dump(path)
+
+
 def load_etc_dump(*path):
     """Load a json/yml/toml file from the detection_rules/etc/ folder."""
-    return eql.utils.load_dump(get_etc_path(*path))
+    path = get_etc_path(*path)
+
+    # json parses faster than the cached contents could be copied, so only cache the slower yml/toml parses
+    if os.path.splitext(path)[1] == '.json':
+        return eql.utils.load_dump(path)
+
+    stat = os.stat(path)
+    # callers are free to modify the loaded contents, so hand out a copy of the cached parse
+    return copy.deepcopy(_load_dump_by_stat(path, stat.st_mtime_ns, stat.st_size))
 
 
 def save_etc_dump(contents, *path, **kwargs):
@@ -142,6 +211,12 @@ def read_gzip(path):
         return gz.read().decode("utf8")
 
 
+def load_gzip_json(path):
+    """Load a gzipped JSON file, parsing the decompressed bytes directly."""
+    with gzip.GzipFile(path, mode='r') as gz:
+        return loads_json(gz.read())
+
+
 @contextlib.contextmanager
 def unzip(contents):  # type: (bytes) -> zipfile.ZipFile
     """Get zipped contents."""
@@ -155,6 +230,37 @@ def unzip(contents):  # type: (bytes) -> zipfile.ZipFile
         archive.close()
 
 
+@contextlib.contextmanager
+def read_mapped(path: Union[str, Path]) -> Iterator[Union[bytes, memoryview]]:
+    """Read the contents of a file, memory mapping larger files on POSIX rather than copying them."""
+    with open(path, 'rb') as f:
+        if sys.platform == 'win32' or os.fstat(f.fileno()).st_size < MMAP_MIN_SIZE:
+            yield f.read()
+            return
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+            yield view
+
+
+@contextlib.contextmanager
+def download_zip(url: str, verbose=False, **kwargs):  # type: (str, bool) -> zipfile.ZipFile
+    """Stream a zip download to a temporary file, rather than buffering the whole response in memory."""
+    import requests
+
+    # SpooledTemporaryFile is not seekable() for zipfile before python 3.11, so use a real temporary file
+    with requests.get(url, stream=True, **kwargs) as response, tempfile.TemporaryFile() as f:
+        response.raise_for_status()
+        for chunk in response.iter_content(chunk_size=1 << 16):
+            f.write(chunk)
+
+        if verbose:
+            print(f"Downloaded {f.tell() / 1024.0 / 1024.0:.2f} MB release.")
+
+        f.seek(0)
+        with zipfile.ZipFile(f, mode="r") as archive:
+            yield archive
+
+
 def unzip_and_save(contents, path, member=None, verbose=True):
     """Save unzipped from raw zipped contents."""
     with unzip(contents) as archive:
@@ -172,12 +278,12 @@ def unzip_and_save(contents, path, member=None, verbose=True):
 def unzip_to_dict(zipped: zipfile.ZipFile, load_json=True) -> Dict[str, Union[dict, str]]:
     """Unzip and load contents to dict with filenames as keys."""
     bundle = {}
-    for filename in zipped.namelist():
-        if filename.endswith('/'):
+    for member in zipped.infolist():
+        if member.is_dir():
             continue
 
-        fp = Path(filename)
-        contents = zipped.read(filename)
+        fp = Path(member.filename)
+        contents = zipped.read(member)
 
         if load_json and fp.suffix == '.json':
             contents = json.loads(contents)
@@ -269,8 +375,19 @@ def cached(f):
     return wrapped
 
 
+_cache_clear_callbacks = []
+
+
+def on_clear_caches(callback: Callable[[], None]):
+    """Register a callback to clear a cache kept outside of @cached when the caches are cleared."""
+    _cache_clear_callbacks.append(callback)
+    return callback
+
+
 def clear_caches():
     _cache.clear()
+    for callback in _cache_clear_callbacks:
+        callback()
 
 
 def load_rule_contents(rule_file: Path, single_only=False) -> list:
@@ -290,7 +407,7 @@ def load_rule_contents(rule_file: Path, single_only=False) -> list:
 
         return contents or [{}]
     elif extension == '.toml':
-        rule = pytoml.loads(raw_text)
+        rule = loads_toml(raw_text)
     else:
         rule = load_dump(rule_file)
 
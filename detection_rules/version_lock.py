@@ -9,11 +9,10 @@ from pathlib import Path
 from typing import ClassVar, Dict, List, Optional, Union
 
 import click
-from semver import Version
 
 from .mixins import LockDataclassMixin, MarshmallowDataclassMixin
 from .rule_loader import RuleCollection
-from .schemas import definitions
+from .schemas import definitions, parse_stack_version
 from .utils import cached, get_etc_path
 
 ETC_VERSION_LOCK_FILE = "version.lock.json"
@@ -174,16 +173,16 @@ class VersionLock:
         """Update the contents of the version.lock file and optionally save changes."""
         from .packaging import current_stack_version
 
-        version_lock_hash = self.version_lock.sha256()
-        lock_file_contents = deepcopy(self.version_lock.to_dict())
-        current_deprecated_lock = deepcopy(self.deprecated_lock.to_dict())
-
         verbose_echo = click.echo if verbose else (lambda x: None)
 
-        already_deprecated = set(current_deprecated_lock)
+        already_deprecated = set(self.deprecated_lock.data)
         deprecated_rules = set(rules.deprecated.id_map)
-        new_rules = set(rule.id for rule in rules if rule.contents.latest_version is None) - deprecated_rules
-        changed_rules = set(rule.id for rule in rules if rule.contents.is_dirty) - deprecated_rules
+
+        # look up each rule's locked version once - unlocked rules are new and cannot be dirty
+        locked_versions = {rule.id: rule.contents.latest_version for rule in rules}
+        new_rules = set(rule_id for rule_id, version in locked_versions.items() if version is None) - deprecated_rules
+        changed_rules = set(rule.id for rule in rules
+                            if locked_versions[rule.id] is not None and rule.contents.is_dirty) - deprecated_rules
 
         # manage deprecated rules
         newly_deprecated = deprecated_rules - already_deprecated
@@ -191,6 +190,11 @@ class VersionLock:
         if not (new_rules or changed_rules or newly_deprecated):
             return list(changed_rules), list(new_rules), list(newly_deprecated)
 
+        # only serialize and hash the lock files once there is something to update
+        version_lock_hash = self.version_lock.sha256()
+        lock_file_contents = deepcopy(self.version_lock.to_dict())
+        current_deprecated_lock = deepcopy(self.deprecated_lock.to_dict())
+
         verbose_echo('Rule changes detected!')
         changes = []
 
@@ -202,8 +206,7 @@ class VersionLock:
         for rule in rules:
             if rule.contents.metadata.maturity == "production" or rule.id in newly_deprecated:
                 # assume that older stacks are always locked first
-                min_stack = Version.parse(rule.contents.get_supported_version(),
-                                          optional_minor_and_patch=True)
+                min_stack = parse_stack_version(rule.contents.get_supported_version())
 
                 lock_from_rule = rule.contents.lock_info(bump=not exclude_version_update)
                 lock_from_file: dict = lock_file_contents.setdefault(rule.id, {})
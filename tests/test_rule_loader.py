@@ -0,0 +1,175 @@
+# Copyright Elasticsearch B.V. and/or licensed to Elasticsearch B.V. under one
+# or more contributor license agreements. Licensed under the Elastic License
+# 2.0; you may not use this file except in compliance with the Elastic License
+# 2.0.
+
+"""Test rule loader caches."""
+import os
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from detection_rules.rule_loader import (DEFAULT_RULES_DIR, RULE_PARSE_CACHE_ENV, RuleCollection, TomlParseCache,
+                                         _walk_toml_files, loaded_rule_cache, metadata_filter)
+from detection_rules.utils import clear_caches
+
+from .base import BaseRuleTest, default_rules
+
+
+class TestWalkTomlFiles(unittest.TestCase):
+    """Test finding rule files."""
+
+    def test_matches_rglob(self):
+        """Test that the walk finds the same files as rglob, without following symlinked directories."""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            root = Path(tmp_dir)
+            (root / 'a' / 'b').mkdir(parents=True)
+            for path in ('top.toml', 'a/x.toml', 'a/b/y.toml', 'a/b/ignored.json'):
+                (root / path).touch()
+            (root / 'a' / 'loop').symlink_to(root / 'a', target_is_directory=True)
+
+            self.assertEqual(sorted(_walk_toml_files(root)), sorted(root.rglob('*.toml')))
+            self.assertEqual(sorted(_walk_toml_files(root, recursive=False)), [root / 'top.toml'])
+
+
+class TestTomlParseCache(unittest.TestCase):
+    """Test the on-disk TOML parse cache."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.root = Path(self.tmp_dir.name)
+        self.cache_path = self.root / 'cache' / 'parsed.pickle'
+        self.toml_path = self.root / 'rule.toml'
+        self.toml_path.write_text('[rule]\nname = "a"\n')
+
+    def test_signature_invalidation(self):
+        """Test that cached contents are only returned while the file's mtime and size are unchanged."""
+        cache = TomlParseCache(self.cache_path)
+        signature = cache.signature(self.toml_path)
+        cache.set(self.toml_path, signature, {'rule': {'name': 'a'}})
+        self.assertEqual(cache.get(self.toml_path, cache.signature(self.toml_path)), {'rule': {'name': 'a'}})
+
+        stat = self.toml_path.stat()
+        os.utime(self.toml_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+        self.assertIsNone(cache.get(self.toml_path, cache.signature(self.toml_path)))
+
+        os.utime(self.toml_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.toml_path.write_text('[rule]\nname = "ab"\n')
+        os.utime(self.toml_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertIsNone(cache.get(self.toml_path, cache.signature(self.toml_path)))
+
+    def test_save_and_reload(self):
+        """Test that the cache is written atomically and only when it changed."""
+        cache = TomlParseCache(self.cache_path)
+        cache.save()
+        self.assertFalse(self.cache_path.exists())
+
+        signature = cache.signature(self.toml_path)
+        cache.set(self.toml_path, signature, {'rule': {'name': 'a'}})
+        cache.save()
+        self.assertFalse(cache.changed)
+        self.assertEqual([p.name for p in self.cache_path.parent.iterdir()], [self.cache_path.name])
+        self.assertEqual(TomlParseCache(self.cache_path).get(self.toml_path, signature), {'rule': {'name': 'a'}})
+
+    def test_corrupt_cache(self):
+        """Test that a corrupt cache file is ignored and rebuilt."""
+        self.cache_path.parent.mkdir()
+        self.cache_path.write_bytes(b'not a pickle')
+
+        cache = TomlParseCache(self.cache_path)
+        self.assertEqual(cache.entries, {})
+
+        signature = cache.signature(self.toml_path)
+        cache.set(self.toml_path, signature, {'rule': {'name': 'a'}})
+        cache.save()
+        self.assertEqual(TomlParseCache(self.cache_path).get(self.toml_path, signature), {'rule': {'name': 'a'}})
+
+    def test_relative_directory_hits(self):
+        """Test that files prefetched from a relative directory are found by the loader."""
+        rules_dir = self.root / 'rules'
+        rules_dir.mkdir()
+        for name in ('a', 'b'):
+            (rules_dir / f'{name}.toml').write_text(f'[rule]\nname = "{name}"\n')
+
+        cwd = os.getcwd()
+        os.chdir(self.root)
+        self.addCleanup(os.chdir, cwd)
+
+        with mock.patch.dict(os.environ, {RULE_PARSE_CACHE_ENV: str(self.cache_path)}):
+            collection = RuleCollection()
+            collection._prefetch_toml_files(collection._get_paths(Path('rules')))
+
+            # a second collection is served entirely from the on-disk cache
+            collection = RuleCollection()
+            with mock.patch('detection_rules.rule_loader._parse_toml_file') as parse:
+                collection._prefetch_toml_files(collection._get_paths(Path('rules')))
+                parse.assert_not_called()
+
+        with mock.patch.object(RuleCollection, 'deserialize_toml_string') as deserialize:
+            for path in sorted(Path('rules').glob('*.toml')):
+                self.assertEqual(collection._load_toml_file(path.resolve())['rule']['name'], path.stem)
+            deserialize.assert_not_called()
+
+
+class TestLoadedRuleCache(unittest.TestCase):
+    """Test sharing loaded rules across collections."""
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        source = next(DEFAULT_RULES_DIR.rglob('*.toml'))
+        self.rule_path = Path(tmp_dir.name) / source.name
+        shutil.copy(source, self.rule_path)
+
+    def test_reuse_and_reload(self):
+        """Test that unchanged files reuse the loaded rule and edited files are loaded again."""
+        rule = RuleCollection().load_file(self.rule_path)
+        self.assertIs(RuleCollection().load_file(self.rule_path), rule)
+
+        self.rule_path.write_text(self.rule_path.read_text().replace(rule.name, f'{rule.name} edited'))
+        edited = RuleCollection().load_file(self.rule_path)
+        self.assertIsNot(edited, rule)
+        self.assertEqual(edited.name, f'{rule.name} edited')
+
+    def test_clear_caches(self):
+        """Test that clearing the caches drops the loaded rules."""
+        rule = RuleCollection().load_file(self.rule_path)
+        clear_caches()
+        self.assertNotIn(self.rule_path.resolve(), loaded_rule_cache.entries)
+        self.assertIsNot(RuleCollection().load_file(self.rule_path), rule)
+
+
+class TestMetadataIndex(BaseRuleTest):
+    """Test that metadata filters answered from the index match a full scan."""
+
+    def assert_matches_scan(self, indexed: bool, **criteria):
+        collection = default_rules()
+        cb = metadata_filter(**criteria)
+        self.assertEqual(collection._filter_metadata_index(criteria) is not None, indexed)
+
+        try:
+            expected = [rule.id for rule in filter(cb, collection.rules)]
+        except Exception as e:
+            with self.assertRaises(type(e)):
+                collection.filter(cb)
+        else:
+            self.assertEqual([rule.id for rule in collection.filter(cb)], expected, criteria)
+
+    def test_indexed_fields(self):
+        """Test scalar and list criteria on indexed fields."""
+        rule = self.all_rules[0]
+        self.assert_matches_scan(True, maturity='production')
+        self.assert_matches_scan(True, maturity=['production', 'development'])
+        self.assert_matches_scan(True, maturity='deprecated')
+        self.assert_matches_scan(True, updated_date=rule.contents.metadata.updated_date)
+        self.assert_matches_scan(True, creation_date=[rule.contents.metadata.creation_date, '1970/01/01'])
+
+    def test_non_indexed_fields(self):
+        """Test criteria that fall back to scanning the rules."""
+        self.assert_matches_scan(False, integration='aws')
+        self.assert_matches_scan(False, query_schema_validation=False)
+        self.assert_matches_scan(False, maturity='production', updated_date='1970/01/01')
+        self.assert_matches_scan(False, **{'maturity.name': 'production'})
@@ -7,7 +7,9 @@
 import random
 import time
 import unittest
+from unittest import mock
 
+from detection_rules import utils
 from detection_rules.utils import normalize_timing_and_sort, cached
 from detection_rules.eswrap import RtaEvents
 from detection_rules.ecs import get_kql_schema
@@ -101,3 +103,17 @@ class TestTimeUtils(unittest.TestCase):
         self.assertEqual(increment(), 6)
         self.assertEqual(increment(None), 7)
         self.assertEqual(increment(1), 8)
+
+
+class TestJsonUtils(unittest.TestCase):
+    """Test JSON serialization helpers."""
+
+    @unittest.skipIf(utils.orjson is None, 'orjson is not installed')
+    def test_json_line_fallback(self):
+        """Test that saved event lines are identical with and without orjson."""
+        event = {'@timestamp': '2020-01-01T00:00:00Z', 'a': '\u00e9', 'n': [1, 2.5, None, True],
+                 'z': {'b': 1, 'a': 'x"y'}}
+        expected = utils.dump_json_line(event)
+
+        with mock.patch.object(utils, 'orjson', None):
+            self.assertEqual(utils.dump_json_line(event), expected)